@@ -2,15 +2,36 @@
 # app.py
 #########################
 
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash
+from flask import Flask, render_template, request, redirect, url_for, send_file, flash, Response, stream_with_context, g, has_app_context, has_request_context, abort
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.schema import CreateColumn
 from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
 from werkzeug.security import generate_password_hash, check_password_hash
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import LETTER
-from io import BytesIO
+from io import BytesIO, StringIO
+from datetime import datetime
+from collections import Counter
+from itertools import chain, zip_longest
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import click
 import csv
+import hashlib
 import json
+import math
+import multiprocessing
+import os
+import pickle
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import unicodedata
+import zipfile
+import zlib
 
 app = Flask(__name__)
 app.secret_key = "MI_SECRETO_SUPER_SEGURO"  # Cambia esto en producción
@@ -18,6 +39,12 @@ app.secret_key = "MI_SECRETO_SUPER_SEGURO"  # Cambia esto en producción
 # Configuración de la base de datos (SQLite local)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///productos.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Procesos para la importación en lote (None = todos los núcleos)
+app.config['IMPORT_WORKERS'] = None
+# Caché del catálogo: 'sqlite' (compartida entre workers, servidor de desarrollo y comandos flask)
+# o 'local' (en memoria; solo para desarrollo, los cambios hechos desde la CLI u otros procesos no la invalidan)
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'sqlite')
+app.config['CACHE_PATH'] = os.environ.get('CACHE_PATH', os.path.join(app.instance_path, 'cache.db'))
 
 db = SQLAlchemy(app)
 
@@ -45,6 +72,9 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+def calcular_precio_final(precio_base, porcentaje_impuestos, porcentaje_ganancia):
+    return precio_base * (1 + porcentaje_impuestos/100) * (1 + porcentaje_ganancia/100)
+
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
@@ -62,24 +92,292 @@ class Product(db.Model):
     # Campo para almacenar en formato JSON las características específicas según la categoría
     detalles = db.Column(db.Text, nullable=True, default="{}")
 
+    # Los ids no se reutilizan: el historial de precios de un producto eliminado sigue siendo suyo
+    __table_args__ = {'sqlite_autoincrement': True}
+
     @property
     def precio_final(self):
-        return self.precio_base * (1 + self.porcentaje_impuestos/100) * (1 + self.porcentaje_ganancia/100)
+        return calcular_precio_final(self.precio_base, self.porcentaje_impuestos, self.porcentaje_ganancia)
 
     def __repr__(self):
         return f"<Product {self.nombre} ({self.tipo})>"
 
+# Datos del producto que se guardan en la fila de baja del historial
+BAJA_CAMPOS = ('tipo', 'nombre', 'marca', 'codigo')
+
+# Campos de precio cuyo historial se conserva
+PRECIO_CAMPOS = ('precio_base', 'porcentaje_impuestos', 'porcentaje_ganancia')
+
+class PriceHistory(db.Model):
+    """
+    Historial de precios (solo se agregan filas). Cada fila guarda únicamente los campos
+    que cambiaron; los demás quedan en NULL y se toman de la fila anterior.
+    Al eliminar un producto se agrega una fila con 'eliminado', sin precios y con los datos
+    del producto (tipo, nombre, marca, código) para poder mostrarlo en consultas a una fecha anterior.
+    """
+    __tablename__ = 'price_history'
+    id = db.Column(db.Integer, primary_key=True)
+    # Sin clave foránea: el historial se conserva aunque el producto se elimine
+    product_id = db.Column(db.Integer, nullable=False)
+    fecha = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    precio_base = db.Column(db.Float, nullable=True)
+    porcentaje_impuestos = db.Column(db.Float, nullable=True)
+    porcentaje_ganancia = db.Column(db.Float, nullable=True)
+    eliminado = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    tipo = db.Column(db.String(50), nullable=True)
+    nombre = db.Column(db.String(100), nullable=True)
+    marca = db.Column(db.String(100), nullable=True)
+    codigo = db.Column(db.String(50), nullable=True)
+
+    # Un índice parcial por campo, que cubre (producto, fecha, valor) solo para las filas donde
+    # el campo cambió: "precio del producto X a la fecha D" es una búsqueda en el índice y
+    # "catálogo a la fecha D" se resuelve recorriendo solo el índice.
+    __table_args__ = tuple(
+        [db.Index('ix_price_history_product_fecha', 'product_id', 'fecha')] +
+        [db.Index(f'ix_price_history_{campo}', 'product_id', 'fecha', campo,
+                  sqlite_where=db.text(f'{campo} IS NOT NULL'),
+                  postgresql_where=db.text(f'{campo} IS NOT NULL'))
+         for campo in PRECIO_CAMPOS]
+    )
+
+    def __repr__(self):
+        return f"<PriceHistory {self.product_id} {self.fecha}>"
+
+@event.listens_for(db.session, 'after_flush')
+def registrar_cambios_de_precio(session, flush_context):
+    """
+    Agrega al historial los precios de los productos creados, los campos de precio
+    modificados y las bajas de este flush (todas las filas en un único INSERT).
+    """
+    fecha = datetime.now()
+    filas = []
+    for product in session.new:
+        if isinstance(product, Product):
+            filas.append(dict({campo: getattr(product, campo) for campo in PRECIO_CAMPOS},
+                              product_id=product.id, fecha=fecha))
+    for product in session.dirty:
+        if not isinstance(product, Product):
+            continue
+        estado = db.inspect(product)
+        cambios = {}
+        for campo in PRECIO_CAMPOS:
+            historia = estado.attrs[campo].history
+            if historia.added and (not historia.deleted or historia.added[0] != historia.deleted[0]):
+                cambios[campo] = historia.added[0]
+        if cambios:
+            filas.append(dict({campo: cambios.get(campo) for campo in PRECIO_CAMPOS},
+                              product_id=product.id, fecha=fecha))
+    for product in session.deleted:
+        if isinstance(product, Product):
+            filas.append(dict({campo: None for campo in PRECIO_CAMPOS},
+                              **{campo: getattr(product, campo) for campo in BAJA_CAMPOS},
+                              product_id=product.id, fecha=fecha, eliminado=True))
+    if filas:
+        # Todas las filas del INSERT deben tener las mismas columnas
+        vacia = dict(dict.fromkeys(BAJA_CAMPOS), eliminado=False)
+        session.connection().execute(PriceHistory.__table__.insert(), [{**vacia, **fila} for fila in filas])
+
+#################################
+# Caché compartida del catálogo
+#################################
+class CacheLocal:
+    """
+    Caché en memoria del proceso (CACHE_BACKEND='local'). Solo para desarrollo: los cambios
+    hechos desde otro proceso, como los comandos flask, no la invalidan.
+    """
+
+    def __init__(self):
+        self._versiones = {}
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def version(self, nombre):
+        return self._versiones.get(nombre, 0)
+
+    def incrementar(self, nombre):
+        with self._lock:
+            self._versiones[nombre] = self._versiones.get(nombre, 0) + 1
+
+    def obtener(self, clave, version):
+        guardado = self._datos.get(clave)
+        if guardado is not None and guardado[0] == version:
+            return guardado[1]
+        return None
+
+    def guardar(self, clave, version, valor):
+        self._datos[clave] = (version, valor)
+
+    def reiniciar(self):
+        self._datos.clear()
+
+class CacheSQLite:
+    """
+    Caché compartida entre procesos (p. ej. workers de gunicorn) en un archivo SQLite.
+    La tabla 'versiones' es el canal de invalidación: cada escritura de productos incrementa
+    la versión y los valores guardados con una versión anterior dejan de usarse.
+    Cada proceso mantiene además una copia en memoria de los valores de la versión vigente.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._hilos = threading.local()
+        self._memoria = {}
+        conexion = self._conexion()
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("CREATE TABLE IF NOT EXISTS versiones (nombre TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        conexion.execute("CREATE TABLE IF NOT EXISTS valores "
+                         "(clave TEXT PRIMARY KEY, version INTEGER NOT NULL, valor BLOB NOT NULL)")
+
+    def _conexion(self):
+        conexion = getattr(self._hilos, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None, check_same_thread=False)
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            self._hilos.conexion = conexion
+        return conexion
+
+    def version(self, nombre):
+        fila = self._conexion().execute("SELECT version FROM versiones WHERE nombre = ?", (nombre,)).fetchone()
+        return fila[0] if fila else 0
+
+    def incrementar(self, nombre):
+        self._conexion().execute(
+            "INSERT INTO versiones (nombre, version) VALUES (?, 1) "
+            "ON CONFLICT(nombre) DO UPDATE SET version = version + 1", (nombre,))
+
+    def obtener(self, clave, version):
+        guardado = self._memoria.get(clave)
+        if guardado is not None and guardado[0] == version:
+            return guardado[1]
+        fila = self._conexion().execute(
+            "SELECT valor FROM valores WHERE clave = ? AND version = ?", (clave, version)).fetchone()
+        if fila is None:
+            return None
+        valor = pickle.loads(fila[0])
+        self._memoria[clave] = (version, valor)
+        return valor
+
+    def guardar(self, clave, version, valor):
+        self._memoria[clave] = (version, valor)
+        # No se pisa un valor de una versión más nueva guardado por otro proceso
+        self._conexion().execute(
+            "INSERT INTO valores (clave, version, valor) VALUES (?, ?, ?) "
+            "ON CONFLICT(clave) DO UPDATE SET version = excluded.version, valor = excluded.valor "
+            "WHERE excluded.version >= valores.version",
+            (clave, version, pickle.dumps(valor, pickle.HIGHEST_PROTOCOL)))
+
+    def reiniciar(self):
+        """Descarta conexiones y memoria heredadas (llamar después de un fork)."""
+        self._hilos = threading.local()
+        self._memoria.clear()
+
+def crear_cache(config):
+    if config['CACHE_BACKEND'] == 'local':
+        return CacheLocal()
+    if config['CACHE_BACKEND'] != 'sqlite':
+        raise ValueError(f"CACHE_BACKEND desconocido: {config['CACHE_BACKEND']}")
+    os.makedirs(os.path.dirname(config['CACHE_PATH']), exist_ok=True)
+    return CacheSQLite(config['CACHE_PATH'])
+
+cache = crear_cache(app.config)
+
+def version_catalogo():
+    """Versión vigente del catálogo (se lee una sola vez por request)."""
+    if has_request_context():
+        if 'version_catalogo' not in g:
+            g.version_catalogo = cache.version('catalogo')
+        return g.version_catalogo
+    return cache.version('catalogo')
+
+def invalidar_catalogo():
+    cache.incrementar('catalogo')
+    if has_app_context():
+        g.pop('version_catalogo', None)
+
+def catalogo_por_categoria():
+    """
+    Devuelve {categoria: [producto]} con los datos de cada producto (incluido 'precio_final').
+    La versión se lee antes de consultar la base, así un valor calculado en paralelo con una
+    escritura queda guardado con la versión vieja y nunca se sirve.
+    """
+    version = version_catalogo()
+    catalogo = cache.obtener('catalogo', version)
+    if catalogo is None:
+        catalogo = {categoria: [] for categoria in CATEGORIAS}
+        for fila in iterar_productos():
+            fila['precio_final'] = calcular_precio_final(fila['precio_base'], fila['porcentaje_impuestos'],
+                                                         fila['porcentaje_ganancia'])
+            catalogo[fila['tipo']].append(fila)
+        cache.guardar('catalogo', version, catalogo)
+    return catalogo
+
+@event.listens_for(db.session, 'after_flush')
+def marcar_catalogo_modificado(session, flush_context):
+    if any(isinstance(obj, Product) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info['catalogo_modificado'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def publicar_invalidacion(session):
+    if session.info.pop('catalogo_modificado', False):
+        invalidar_catalogo()
+
+@event.listens_for(db.session, 'after_rollback')
+def descartar_invalidacion(session):
+    session.info.pop('catalogo_modificado', None)
+
 #################################
 # Crear la base de datos y el usuario admin fijo
 #################################
-with app.app_context():
-    db.create_all()
-    admin = User.query.filter_by(username='ezequiel1407').first()
-    if not admin:
-        admin = User(username='ezequiel1407', role='admin')
-        admin.set_password('larenga73')
-        db.session.add(admin)
+# Los procesos del pool de importación (spawn) importan este módulo: no repiten la inicialización
+def migrar_sqlite():
+    """
+    Adapta bases SQLite creadas por versiones anteriores (create_all no modifica tablas existentes):
+    - agrega a price_history las columnas que le falten;
+    - reconstruye product con AUTOINCREMENT y lleva su secuencia al mayor id usado, también por
+      productos ya eliminados, para que un producto nuevo nunca reciba el id (y el historial) de otro.
+    """
+    conexion = db.session.connection()
+    existentes = {fila[1] for fila in conexion.exec_driver_sql("PRAGMA table_info(price_history)")}
+    for columna in PriceHistory.__table__.columns:
+        if columna.name not in existentes:
+            definicion = CreateColumn(columna).compile(dialect=db.engine.dialect)
+            conexion.exec_driver_sql(f"ALTER TABLE price_history ADD COLUMN {definicion}")
+    esquema = conexion.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'product'").scalar()
+    if 'AUTOINCREMENT' not in esquema.upper():
+        existentes = {fila[1] for fila in conexion.exec_driver_sql("PRAGMA table_info(product)")}
+        columnas = ', '.join(c.name for c in Product.__table__.columns if c.name in existentes)
+        conexion.exec_driver_sql("ALTER TABLE product RENAME TO product_anterior")
+        Product.__table__.create(conexion)
+        conexion.exec_driver_sql(f"INSERT INTO product ({columnas}) SELECT {columnas} FROM product_anterior")
+        conexion.exec_driver_sql("DROP TABLE product_anterior")
+    maximo = conexion.exec_driver_sql(
+        "SELECT MAX(COALESCE((SELECT MAX(id) FROM product), 0), "
+        "COALESCE((SELECT MAX(product_id) FROM price_history), 0))").scalar()
+    if not conexion.exec_driver_sql("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'product'",
+                                    (maximo,)).rowcount:
+        conexion.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('product', ?)", (maximo,))
+
+if multiprocessing.parent_process() is None:
+    with app.app_context():
+        db.create_all()
+        if db.engine.dialect.name == 'sqlite':
+            # WAL permite lecturas concurrentes desde varios workers mientras otro escribe
+            db.session.execute(db.text("PRAGMA journal_mode=WAL"))
+            migrar_sqlite()
+        # Precio inicial en el historial para los productos que todavía no tienen ninguno
+        db.session.execute(db.text(
+            "INSERT INTO price_history (product_id, fecha, precio_base, porcentaje_impuestos, porcentaje_ganancia) "
+            "SELECT id, :fecha, precio_base, porcentaje_impuestos, porcentaje_ganancia FROM product "
+            "WHERE NOT EXISTS (SELECT 1 FROM price_history WHERE price_history.product_id = product.id)"),
+            {'fecha': datetime.now()})
         db.session.commit()
+        admin = User.query.filter_by(username='ezequiel1407').first()
+        if not admin:
+            admin = User(username='ezequiel1407', role='admin')
+            admin.set_password('larenga73')
+            db.session.add(admin)
+            db.session.commit()
 
 #################################
 # Flask-Login Loader
@@ -162,13 +460,14 @@ def list_products():
     Los usuarios 'admin' ven datos completos (incluyendo precio base, % de impuestos y ganancia, y botones CRUD),
     mientras que los demás ven únicamente los datos técnicos y el precio final.
     """
-    inversores = Product.query.filter_by(tipo='inversor').all()
-    paneles = Product.query.filter_by(tipo='panel').all()
-    protecciones_cc = Product.query.filter_by(tipo='protecciones_cc').all()
-    protecciones_ca = Product.query.filter_by(tipo='protecciones_ca').all()
-    estructuras = Product.query.filter_by(tipo='estructura').all()
-    cables = Product.query.filter_by(tipo='cable').all()
-    fichas = Product.query.filter_by(tipo='fichas').all()
+    catalogo = catalogo_por_categoria()
+    inversores = catalogo['inversor']
+    paneles = catalogo['panel']
+    protecciones_cc = catalogo['protecciones_cc']
+    protecciones_ca = catalogo['protecciones_ca']
+    estructuras = catalogo['estructura']
+    cables = catalogo['cable']
+    fichas = catalogo['fichas']
     return render_template('products.html',
                            inversores=inversores,
                            paneles=paneles,
@@ -297,6 +596,9 @@ def upload_products():
         if not categoria:
             flash("Debes seleccionar una categoría.", "danger")
             return redirect(url_for('upload_products'))
+        if categoria not in CATEGORIAS:
+            flash("Categoría desconocida.", "danger")
+            return redirect(url_for('upload_products'))
         if 'file' not in request.files:
             flash("No se encontró el archivo.", "danger")
             return redirect(request.url)
@@ -307,248 +609,14 @@ def upload_products():
         try:
             file_stream = file.stream.read().decode("utf-8").splitlines()
             reader = csv.DictReader(file_stream)
-            count = 0
-            for row in reader:
-                if categoria == 'inversor':
-                    marca = row.get('marca', 'N/A')
-                    modelo = row.get('modelo', 'N/A')
-                    tipo_inversor = row.get('tipo_inversor', 'N/A')
-                    potencia_nominal = row.get('potencia_nominal', '0')
-                    tension_entrada_cc = row.get('tension_entrada_cc', '0')
-                    tension_salida_ca = row.get('tension_salida_ca', '0')
-                    regulador_mppt = row.get('regulador_mppt', 'N/A')
-                    corriente_max_por_string = row.get('corriente_max_por_string', '0')
-                    potencia_max_paneles = row.get('potencia_max_paneles', '0')
-                    conectividad = row.get('conectividad', 'N/A')
-                    tipo_proteccion_cc = row.get('tipo_proteccion_cc', 'N/A')
-                    proteccion_cc = row.get('proteccion_cc', 'N/A')
-                    tipo_proteccion_ca = row.get('tipo_proteccion_ca', 'N/A')
-                    proteccion_ca = row.get('proteccion_ca', 'N/A')
-                    try:
-                        precio_base = float(row.get('precio_base', 0))
-                    except:
-                        precio_base = 0.0
-                    try:
-                        porcentaje_impuestos = float(row.get('porcentaje_impuestos', 0))
-                    except:
-                        porcentaje_impuestos = 0.0
-                    try:
-                        porcentaje_ganancia = float(row.get('porcentaje_ganancia', 0))
-                    except:
-                        porcentaje_ganancia = 0.0
-                    product = Product(
-                        nombre=modelo,
-                        marca=marca,
-                        codigo=tipo_inversor,
-                        precio_base=precio_base,
-                        porcentaje_impuestos=porcentaje_impuestos,
-                        porcentaje_ganancia=porcentaje_ganancia,
-                        potencia=float(potencia_nominal) if potencia_nominal else 0.0,
-                        voltaje_maximo=float(tension_salida_ca) if tension_salida_ca else 0.0,
-                        string_count=int(float(corriente_max_por_string)) if corriente_max_por_string else 0,
-                        amperaje_maximo=0.0,
-                        tipo='inversor',
-                        detalles=json.dumps({
-                            "tipo_inversor": tipo_inversor,
-                            "potencia_nominal": potencia_nominal,
-                            "tension_entrada_cc": tension_entrada_cc,
-                            "tension_salida_ca": tension_salida_ca,
-                            "regulador_mppt": regulador_mppt,
-                            "corriente_max_por_string": corriente_max_por_string,
-                            "potencia_max_paneles": potencia_max_paneles,
-                            "conectividad": conectividad,
-                            "tipo_proteccion_cc": tipo_proteccion_cc,
-                            "proteccion_cc": proteccion_cc,
-                            "tipo_proteccion_ca": tipo_proteccion_ca,
-                            "proteccion_ca": proteccion_ca
-                        })
-                    )
-                elif categoria == 'panel':
-                    proveedor = row.get('proveedor', 'N/A')
-                    marca = row.get('marca', 'N/A')
-                    modelo = row.get('modelo', 'N/A')
-                    potencia = row.get('potencia', '0')
-                    voltaje = row.get('voltaje', '0')
-                    tension = row.get('tension', '0')
-                    tipo_panel = row.get('tipo_panel', 'N/A')
-                    try:
-                        precio_base = float(row.get('precio_base', 0))
-                    except:
-                        precio_base = 0.0
-                    try:
-                        porcentaje_ganancia = float(row.get('porcentaje_ganancia', 0))
-                    except:
-                        porcentaje_ganancia = 0.0
-                    product = Product(
-                        nombre=modelo,
-                        marca=marca,
-                        codigo='',
-                        precio_base=precio_base,
-                        porcentaje_impuestos=0.0,
-                        porcentaje_ganancia=porcentaje_ganancia,
-                        potencia=float(potencia) if potencia else 0.0,
-                        voltaje_maximo=float(voltaje) if voltaje else 0.0,
-                        string_count=0,
-                        amperaje_maximo=0.0,
-                        tipo='panel',
-                        detalles=json.dumps({
-                            "proveedor": proveedor,
-                            "potencia": potencia,
-                            "voltaje": voltaje,
-                            "tension": tension,
-                            "tipo_panel": tipo_panel
-                        })
-                    )
-                elif categoria in ['protecciones_cc', 'protecciones_ca']:
-                    marca = row.get('marca', 'N/A')
-                    modelo = row.get('modelo', 'N/A')
-                    proveedor = row.get('proveedor', 'N/A')
-                    try:
-                        precio_base = float(row.get('precio_base', 0))
-                    except:
-                        precio_base = 0.0
-                    try:
-                        porcentaje_ganancia = float(row.get('porcentaje_ganancia', 0))
-                    except:
-                        porcentaje_ganancia = 0.0
-                    ubicacion = row.get('ubicacion', 'N/A')
-                    tension_nominal_operacion = row.get('tension_nominal_operacion', '0')
-                    corriente_descarga_nominal = row.get('corriente_descarga_nominal', '0')
-                    corriente_descarga_maxima = row.get('corriente_descarga_maxima', '0')
-                    tecnologia_proteccion = row.get('tecnologia_proteccion', 'N/A')
-                    clase_proteccion = row.get('clase_proteccion', 'N/A')
-                    indicador_estado = row.get('indicador_estado', 'N/A')
-                    montaje_caja = row.get('montaje_caja', 'N/A')
-                    product = Product(
-                        nombre=modelo,
-                        marca=marca,
-                        codigo='',
-                        precio_base=precio_base,
-                        porcentaje_impuestos=0.0,
-                        porcentaje_ganancia=porcentaje_ganancia,
-                        potencia=0.0,
-                        voltaje_maximo=0.0,
-                        string_count=0,
-                        amperaje_maximo=0.0,
-                        tipo=categoria,
-                        detalles=json.dumps({
-                            "proveedor": proveedor,
-                            "ubicacion": ubicacion,
-                            "tension_nominal_operacion": tension_nominal_operacion,
-                            "corriente_descarga_nominal": corriente_descarga_nominal,
-                            "corriente_descarga_maxima": corriente_descarga_maxima,
-                            "tecnologia_proteccion": tecnologia_proteccion,
-                            "clase_proteccion": clase_proteccion,
-                            "indicador_estado": indicador_estado,
-                            "montaje_caja": montaje_caja
-                        })
-                    )
-                elif categoria == 'estructura':
-                    proveedor = row.get('proveedor', 'N/A')
-                    marca = row.get('marca', 'N/A')
-                    modelo = row.get('modelo', 'N/A')
-                    tipo_estructura = row.get('tipo_estructura', 'N/A')
-                    cantidad_paneles = row.get('cantidad_paneles', '0')
-                    material = row.get('material', 'N/A')
-                    inclinacion = row.get('inclinacion', '0')
-                    try:
-                        precio_base = float(row.get('precio_base', 0))
-                    except:
-                        precio_base = 0.0
-                    try:
-                        porcentaje_ganancia = float(row.get('porcentaje_ganancia', 0))
-                    except:
-                        porcentaje_ganancia = 0.0
-                    product = Product(
-                        nombre=modelo,
-                        marca=marca,
-                        codigo='',
-                        precio_base=precio_base,
-                        porcentaje_impuestos=0.0,
-                        porcentaje_ganancia=porcentaje_ganancia,
-                        potencia=0.0,
-                        voltaje_maximo=0.0,
-                        string_count=0,
-                        amperaje_maximo=0.0,
-                        tipo='estructura',
-                        detalles=json.dumps({
-                            "proveedor": proveedor,
-                            "tipo_estructura": tipo_estructura,
-                            "cantidad_paneles": cantidad_paneles,
-                            "material": material,
-                            "inclinacion": inclinacion
-                        })
-                    )
-                elif categoria == 'cable':
-                    proveedor = row.get('proveedor', 'N/A')
-                    marca = row.get('marca', 'N/A')
-                    modelo = row.get('modelo', 'N/A')
-                    tipo_cable = row.get('tipo_cable', 'N/A')
-                    espesor = row.get('espesor', '0')
-                    tipo_baina = row.get('tipo_baina', 'N/A')
-                    try:
-                        precio_base = float(row.get('precio_base', 0))
-                    except:
-                        precio_base = 0.0
-                    try:
-                        porcentaje_ganancia = float(row.get('porcentaje_ganancia', 0))
-                    except:
-                        porcentaje_ganancia = 0.0
-                    product = Product(
-                        nombre=modelo,
-                        marca=marca,
-                        codigo='',
-                        precio_base=precio_base,
-                        porcentaje_impuestos=0.0,
-                        porcentaje_ganancia=porcentaje_ganancia,
-                        potencia=0.0,
-                        voltaje_maximo=0.0,
-                        string_count=0,
-                        amperaje_maximo=0.0,
-                        tipo='cable',
-                        detalles=json.dumps({
-                            "proveedor": proveedor,
-                            "tipo_cable": tipo_cable,
-                            "espesor": espesor,
-                            "tipo_baina": tipo_baina
-                        })
-                    )
-                elif categoria == 'fichas':
-                    tipo_ficha = row.get('tipo_ficha', 'N/A')
-                    marca = row.get('marca', 'N/A')
-                    modelo = row.get('modelo', 'N/A')
-                    proveedor = row.get('proveedor', 'N/A')
-                    try:
-                        precio_base = float(row.get('precio_base', 0))
-                    except:
-                        precio_base = 0.0
-                    try:
-                        porcentaje_ganancia = float(row.get('porcentaje_ganancia', 0))
-                    except:
-                        porcentaje_ganancia = 0.0
-                    product = Product(
-                        nombre=modelo,
-                        marca=marca,
-                        codigo='',
-                        precio_base=precio_base,
-                        porcentaje_impuestos=0.0,
-                        porcentaje_ganancia=porcentaje_ganancia,
-                        potencia=0.0,
-                        voltaje_maximo=0.0,
-                        string_count=0,
-                        amperaje_maximo=0.0,
-                        tipo='fichas',
-                        detalles=json.dumps({
-                            "tipo_ficha": tipo_ficha,
-                            "proveedor": proveedor
-                        })
-                    )
-                else:
-                    continue
-                db.session.add(product)
-                count += 1
+            productos, errores = validar_filas(categoria, list(reader))
+            for datos in productos:
+                db.session.add(Product(**datos))
+            count = len(productos)
             db.session.commit()
             flash(f'Se han cargado {count} productos correctamente.', 'success')
+            if errores:
+                flash(f"Se omitieron {len(errores)} filas: {'; '.join(errores[:5])}", 'warning')
             return redirect(url_for('list_products'))
         except Exception as e:
             flash(f'Error al procesar el archivo: {e}', 'danger')
@@ -556,6 +624,57 @@ def upload_products():
     else:
         return render_template('upload_products.html')
 
+#################################
+# Encabezados CSV por categoría
+#################################
+CATEGORIAS = ['inversor', 'panel', 'protecciones_cc', 'protecciones_ca', 'estructura', 'cable', 'fichas']
+
+_HEADERS_PROTECCIONES = ['marca', 'modelo', 'proveedor', 'precio_base', 'porcentaje_ganancia', 'ubicacion', 'tension_nominal_operacion', 'corriente_descarga_nominal', 'corriente_descarga_maxima', 'tecnologia_proteccion', 'clase_proteccion', 'indicador_estado', 'montaje_caja']
+_EJEMPLO_PROTECCIONES = ['MarcaR', 'ModeloS', 'ProveedorT', '200', '30', 'Tablero', '230', '5', '10', 'MOV', 'TipoII', 'LED', 'Cuadro']
+
+CSV_HEADERS = {
+    'inversor': ['marca', 'modelo', 'tipo_inversor', 'potencia_nominal', 'tension_entrada_cc', 'tension_salida_ca', 'regulador_mppt', 'corriente_max_por_string', 'potencia_max_paneles', 'conectividad', 'tipo_proteccion_cc', 'proteccion_cc', 'tipo_proteccion_ca', 'proteccion_ca', 'precio_base', 'porcentaje_impuestos', 'porcentaje_ganancia'],
+    'panel': ['proveedor', 'marca', 'modelo', 'potencia', 'voltaje', 'tension', 'tipo_panel', 'precio_base', 'porcentaje_ganancia'],
+    'protecciones_cc': _HEADERS_PROTECCIONES,
+    'protecciones_ca': _HEADERS_PROTECCIONES,
+    'estructura': ['proveedor', 'marca', 'modelo', 'tipo_estructura', 'cantidad_paneles', 'material', 'inclinacion', 'precio_base', 'porcentaje_ganancia'],
+    'cable': ['proveedor', 'marca', 'modelo', 'tipo_cable', 'espesor', 'tipo_baina', 'precio_base', 'porcentaje_ganancia'],
+    'fichas': ['tipo_ficha', 'marca', 'modelo', 'proveedor', 'precio_base', 'porcentaje_ganancia'],
+}
+
+CSV_EJEMPLOS = {
+    'inversor': ['MarcaX', 'ModeloY', 'TipoA', '500', '300', '230', 'Si', '10', '600', 'WiFi', 'Interior', 'Protegido', 'Exterior', 'No', '1000', '15', '20'],
+    'panel': ['ProveedorZ', 'MarcaP', 'ModeloQ', '250', '40', '35', 'Tipo1', '500', '25'],
+    'protecciones_cc': _EJEMPLO_PROTECCIONES,
+    'protecciones_ca': _EJEMPLO_PROTECCIONES,
+    'estructura': ['ProveedorU', 'MarcaV', 'ModeloW', 'TipoE', '10', 'Aluminio', '30', '800', '20'],
+    'cable': ['ProveedorX', 'MarcaY', 'ModeloZ', 'TipoC', '2.5', 'Aislado', '100', '15'],
+    'fichas': ['TipoF', 'MarcaG', 'ModeloH', 'ProveedorI', '50', '10'],
+}
+
+# Columnas de Product que se completan a partir de columnas del CSV (además de marca, modelo y precios).
+CSV_MAPEO_NUMERICO = {
+    'inversor': {'potencia': 'potencia_nominal', 'voltaje_maximo': 'tension_salida_ca',
+                 'string_count': 'corriente_max_por_string'},
+    'panel': {'potencia': 'potencia', 'voltaje_maximo': 'voltaje'},
+}
+
+# Valores que las cargas usan como "sin dato"
+VALORES_VACIOS = (None, '', 'N/A')
+
+def _es_numero(valor):
+    try:
+        float(valor)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+# Columnas con un número en el CSV de ejemplo (si falta el dato se completan con '0').
+CSV_NUMERICOS = {
+    categoria: [h for h, ejemplo in zip(CSV_HEADERS[categoria], CSV_EJEMPLOS[categoria]) if _es_numero(ejemplo)]
+    for categoria in CATEGORIAS
+}
+
 #################################
 # Ruta para descargar archivo CSV de ejemplo
 #################################
@@ -565,28 +684,12 @@ def download_sample(categoria):
     if current_user.role != 'admin':
         flash("No tienes permiso para descargar el ejemplo.", "danger")
         return redirect(url_for('upload_products'))
-    output = []
-    if categoria == 'inversor':
-        headers = ['marca', 'modelo', 'tipo_inversor', 'potencia_nominal', 'tension_entrada_cc', 'tension_salida_ca', 'regulador_mppt', 'corriente_max_por_string', 'potencia_max_paneles', 'conectividad', 'tipo_proteccion_cc', 'proteccion_cc', 'tipo_proteccion_ca', 'proteccion_ca', 'precio_base', 'porcentaje_impuestos', 'porcentaje_ganancia']
-        example = ['MarcaX', 'ModeloY', 'TipoA', '500', '300', '230', 'Si', '10', '600', 'WiFi', 'Interior', 'Protegido', 'Exterior', 'No', '1000', '15', '20']
-    elif categoria == 'panel':
-        headers = ['proveedor', 'marca', 'modelo', 'potencia', 'voltaje', 'tension', 'tipo_panel', 'precio_base', 'porcentaje_ganancia']
-        example = ['ProveedorZ', 'MarcaP', 'ModeloQ', '250', '40', '35', 'Tipo1', '500', '25']
-    elif categoria in ['protecciones_cc', 'protecciones_ca']:
-        headers = ['marca', 'modelo', 'proveedor', 'precio_base', 'porcentaje_ganancia', 'ubicacion', 'tension_nominal_operacion', 'corriente_descarga_nominal', 'corriente_descarga_maxima', 'tecnologia_proteccion', 'clase_proteccion', 'indicador_estado', 'montaje_caja']
-        example = ['MarcaR', 'ModeloS', 'ProveedorT', '200', '30', 'Tablero', '230', '5', '10', 'MOV', 'TipoII', 'LED', 'Cuadro']
-    elif categoria == 'estructura':
-        headers = ['proveedor', 'marca', 'modelo', 'tipo_estructura', 'cantidad_paneles', 'material', 'inclinacion', 'precio_base', 'porcentaje_ganancia']
-        example = ['ProveedorU', 'MarcaV', 'ModeloW', 'TipoE', '10', 'Aluminio', '30', '800', '20']
-    elif categoria == 'cable':
-        headers = ['proveedor', 'marca', 'modelo', 'tipo_cable', 'espesor', 'tipo_baina', 'precio_base', 'porcentaje_ganancia']
-        example = ['ProveedorX', 'MarcaY', 'ModeloZ', 'TipoC', '2.5', 'Aislado', '100', '15']
-    elif categoria == 'fichas':
-        headers = ['tipo_ficha', 'marca', 'modelo', 'proveedor', 'precio_base', 'porcentaje_ganancia']
-        example = ['TipoF', 'MarcaG', 'ModeloH', 'ProveedorI', '50', '10']
-    else:
+    if categoria not in CSV_HEADERS:
         flash("Categoría desconocida.", "danger")
         return redirect(url_for('upload_products'))
+    output = []
+    headers = CSV_HEADERS[categoria]
+    example = CSV_EJEMPLOS[categoria]
     output.append(','.join(headers))
     output.append(','.join(example))
     csv_data = "\n".join(output)
@@ -595,6 +698,1057 @@ def download_sample(categoria):
                      download_name=f'sample_{categoria}.csv',
                      mimetype='text/csv')
 
+#################################
+# Exportación del catálogo (CSV, JSON Lines y columnar)
+#################################
+EXPORT_LOTE = 1000
+COLUMNAR_MAGIC = b'PSCOL1\n'
+COLUMNAR_INT_NULO = -2 ** 63
+COLUMNAR_STR_NULO = 0xFFFFFFFF
+
+# Encabezados del CSV de ejemplo que se toman de columnas propias de Product
+# (el resto se obtiene del campo 'detalles').
+CSV_COLUMNAS_PRODUCTO = {
+    'marca': 'marca',
+    'modelo': 'nombre',
+    'precio_base': 'precio_base',
+    'porcentaje_impuestos': 'porcentaje_impuestos',
+    'porcentaje_ganancia': 'porcentaje_ganancia',
+}
+
+def columnas_producto():
+    """
+    Devuelve [(nombre, tipo)] de las columnas de Product, donde tipo es
+    'i' (entero), 'f' (float) o 's' (texto).
+    """
+    columnas = []
+    for col in Product.__table__.columns:
+        if isinstance(col.type, db.Integer):
+            columnas.append((col.name, 'i'))
+        elif isinstance(col.type, db.Float):
+            columnas.append((col.name, 'f'))
+        else:
+            columnas.append((col.name, 's'))
+    return columnas
+
+def iterar_productos(categoria=None):
+    """
+    Recorre la tabla Product categoría por categoría usando un cursor del servidor
+    y lotes de EXPORT_LOTE filas, devolviendo un dict por fila (sin cargar la tabla en memoria).
+    """
+    nombres = [nombre for nombre, _ in columnas_producto()]
+    columnas = [getattr(Product, nombre) for nombre in nombres]
+    categorias = [categoria] if categoria else CATEGORIAS
+    for cat in categorias:
+        query = (db.session.query(*columnas)
+                 .filter(Product.tipo == cat)
+                 .order_by(Product.id)
+                 .execution_options(stream_results=True)
+                 .yield_per(EXPORT_LOTE))
+        for row in query:
+            yield dict(zip(nombres, row))
+
+def _cargar_detalles(detalles):
+    try:
+        valor = json.loads(detalles or "{}")
+    except ValueError:
+        return {}
+    return valor if isinstance(valor, dict) else {}
+
+def exportar_csv(categoria):
+    """Genera el CSV de una categoría con los mismos encabezados que download_sample."""
+    headers = CSV_HEADERS[categoria]
+    numericas = CSV_NUMERICOS[categoria]
+    # Productos cargados a mano no tienen 'detalles': se usan las columnas de Product equivalentes
+    respaldo = {h: campo for campo, h in CSV_MAPEO_NUMERICO.get(categoria, {}).items()}
+    if categoria == 'inversor':
+        respaldo['tipo_inversor'] = 'codigo'
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for i, fila in enumerate(iterar_productos(categoria), 1):
+        detalles = _cargar_detalles(fila['detalles'])
+        valores = []
+        for h in headers:
+            if h in CSV_COLUMNAS_PRODUCTO:
+                valor = fila[CSV_COLUMNAS_PRODUCTO[h]]
+            else:
+                valor = detalles.get(h)
+                if valor in VALORES_VACIOS and h in respaldo:
+                    valor = fila[respaldo[h]]
+                if valor in VALORES_VACIOS:
+                    valor = '0' if h in numericas else 'N/A'
+            valores.append('' if valor is None else valor)
+        writer.writerow(valores)
+        if i % EXPORT_LOTE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def exportar_jsonl(categoria=None):
+    """Genera una línea JSON por producto, con 'detalles' como objeto."""
+    lineas = []
+    for fila in iterar_productos(categoria):
+        fila['detalles'] = _cargar_detalles(fila['detalles'])
+        lineas.append(json.dumps(fila, ensure_ascii=False))
+        if len(lineas) == EXPORT_LOTE:
+            yield "\n".join(lineas) + "\n"
+            lineas = []
+    if lineas:
+        yield "\n".join(lineas) + "\n"
+
+def _array_le(tipo, valores):
+    arr = array(tipo, valores)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+def _empaquetar_bloque(esquema, filas):
+    partes = [struct.pack('<I', len(filas))]
+    for nombre, tipo in esquema:
+        valores = [fila[nombre] for fila in filas]
+        if tipo == 'i':
+            datos = _array_le('q', [COLUMNAR_INT_NULO if v is None else v for v in valores]).tobytes()
+        elif tipo == 'f':
+            datos = _array_le('d', [float('nan') if v is None else v for v in valores]).tobytes()
+        else:
+            codificados = [None if v is None else v.encode('utf-8') for v in valores]
+            largos = _array_le('I', [COLUMNAR_STR_NULO if v is None else len(v) for v in codificados])
+            datos = largos.tobytes() + b''.join(v for v in codificados if v)
+        comprimido = zlib.compress(datos)
+        partes.append(struct.pack('<I', len(comprimido)))
+        partes.append(comprimido)
+    return b''.join(partes)
+
+def exportar_columnar(categoria=None):
+    """
+    Genera el formato columnar binario: cabecera COLUMNAR_MAGIC, esquema en JSON y luego
+    bloques de hasta EXPORT_LOTE filas en los que cada columna se guarda contigua y comprimida
+    con zlib. Un bloque con 0 filas marca el final del archivo.
+    """
+    esquema = columnas_producto()
+    cabecera = json.dumps(esquema).encode('utf-8')
+    yield COLUMNAR_MAGIC + struct.pack('<I', len(cabecera)) + cabecera
+    filas = []
+    for fila in iterar_productos(categoria):
+        filas.append(fila)
+        if len(filas) == EXPORT_LOTE:
+            yield _empaquetar_bloque(esquema, filas)
+            filas = []
+    if filas:
+        yield _empaquetar_bloque(esquema, filas)
+    yield struct.pack('<I', 0)
+
+def _leer_exacto(stream, n):
+    datos = stream.read(n)
+    if len(datos) != n:
+        raise ValueError("Archivo columnar truncado.")
+    return datos
+
+def leer_columnar(stream):
+    """Lee un archivo generado por exportar_columnar y devuelve un dict por fila."""
+    if stream.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("El archivo no está en formato columnar.")
+    (largo,) = struct.unpack('<I', _leer_exacto(stream, 4))
+    esquema = json.loads(_leer_exacto(stream, largo).decode('utf-8'))
+    while True:
+        (n,) = struct.unpack('<I', _leer_exacto(stream, 4))
+        if n == 0:
+            return
+        columnas = {}
+        for nombre, tipo in esquema:
+            (largo,) = struct.unpack('<I', _leer_exacto(stream, 4))
+            datos = zlib.decompress(_leer_exacto(stream, largo))
+            if tipo in ('i', 'f'):
+                arr = array('q' if tipo == 'i' else 'd')
+                arr.frombytes(datos)
+                if sys.byteorder == 'big':
+                    arr.byteswap()
+                if tipo == 'i':
+                    columnas[nombre] = [None if v == COLUMNAR_INT_NULO else v for v in arr]
+                else:
+                    columnas[nombre] = [None if v != v else v for v in arr]
+            else:
+                largos = array('I')
+                largos.frombytes(datos[:4 * n])
+                if sys.byteorder == 'big':
+                    largos.byteswap()
+                valores = []
+                pos = 4 * n
+                for l in largos:
+                    if l == COLUMNAR_STR_NULO:
+                        valores.append(None)
+                    else:
+                        valores.append(datos[pos:pos + l].decode('utf-8'))
+                        pos += l
+                columnas[nombre] = valores
+        for i in range(n):
+            yield {nombre: columnas[nombre][i] for nombre, _ in esquema}
+
+def leer_jsonl(stream):
+    """Lee un archivo generado por exportar_jsonl y devuelve un dict por fila."""
+    for linea in stream:
+        if isinstance(linea, bytes):
+            linea = linea.decode('utf-8')
+        linea = linea.strip()
+        if not linea:
+            continue
+        fila = json.loads(linea)
+        if isinstance(fila.get('detalles'), dict):
+            fila['detalles'] = json.dumps(fila['detalles'])
+        yield fila
+
+def _insertar_productos(lote):
+    """Inserta un lote de productos y su precio inicial en el historial."""
+    insert = Product.__table__.insert().returning(Product.id, sort_by_parameter_order=True)
+    ids = db.session.execute(insert, lote).scalars().all()
+    fecha = datetime.now()
+    db.session.execute(PriceHistory.__table__.insert(), [
+        dict({campo: fila.get(campo, 0.0) for campo in PRECIO_CAMPOS}, product_id=pid, fecha=fecha)
+        for pid, fila in zip(ids, lote)
+    ])
+    # Los INSERT de Core no pasan por el flush del ORM: se avisa a la caché explícitamente
+    db.session.info['catalogo_modificado'] = True
+    return len(ids)
+
+def importar_filas(filas):
+    """
+    Inserta en bloque filas leídas de una exportación (JSON Lines o columnar).
+    Se descarta el 'id' original para que la importación sea siempre un alta.
+    Devuelve la cantidad de productos insertados.
+    """
+    count = 0
+    lote = []
+    for fila in filas:
+        fila = dict(fila)
+        fila.pop('id', None)
+        lote.append(fila)
+        if len(lote) == EXPORT_LOTE:
+            count += _insertar_productos(lote)
+            lote = []
+    if lote:
+        count += _insertar_productos(lote)
+    db.session.commit()
+    return count
+
+EXPORT_FORMATOS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'columnar': ('application/octet-stream', 'pscol'),
+}
+
+def generar_exportacion(formato, categoria=None):
+    if formato == 'csv':
+        return exportar_csv(categoria)
+    if formato == 'jsonl':
+        return exportar_jsonl(categoria)
+    return exportar_columnar(categoria)
+
+@app.route('/export_products/<formato>')
+@app.route('/export_products/<formato>/<categoria>')
+@login_required
+def export_products(formato, categoria=None):
+    """
+    Descarga el catálogo en CSV (una categoría, mismos encabezados que download_sample),
+    JSON Lines o formato columnar. La respuesta se genera en streaming.
+    Solo el usuario admin puede exportar.
+    """
+    if current_user.role != 'admin':
+        flash("No tienes permiso para exportar productos.", "danger")
+        return redirect(url_for('list_products'))
+    if formato not in EXPORT_FORMATOS:
+        flash("Formato de exportación desconocido.", "danger")
+        return redirect(url_for('list_products'))
+    if categoria is not None and categoria not in CATEGORIAS:
+        flash("Categoría desconocida.", "danger")
+        return redirect(url_for('list_products'))
+    if formato == 'csv' and categoria is None:
+        flash("Para exportar en CSV debes indicar una categoría.", "warning")
+        return redirect(url_for('list_products'))
+    mimetype, extension = EXPORT_FORMATOS[formato]
+    nombre = f"productos_{categoria or 'todos'}.{extension}"
+    return Response(stream_with_context(generar_exportacion(formato, categoria)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={nombre}'})
+
+@app.cli.command('export-products')
+@click.argument('formato', type=click.Choice(list(EXPORT_FORMATOS)))
+@click.argument('salida', type=click.Path(dir_okay=False))
+@click.option('--categoria', type=click.Choice(CATEGORIAS), default=None)
+def export_products_command(formato, salida, categoria):
+    """Exporta el catálogo a un archivo (flask export-products jsonl catalogo.jsonl)."""
+    if formato == 'csv' and categoria is None:
+        raise click.UsageError("Para exportar en CSV debes indicar --categoria.")
+    modo = 'wb' if formato == 'columnar' else 'w'
+    with open(salida, modo, **({} if modo == 'wb' else {'encoding': 'utf-8', 'newline': ''})) as f:
+        for parte in generar_exportacion(formato, categoria):
+            f.write(parte)
+    click.echo(f"Catálogo exportado en {salida}.")
+
+@app.cli.command('import-products')
+@click.argument('formato', type=click.Choice(['jsonl', 'columnar']))
+@click.argument('entrada', type=click.Path(exists=True, dir_okay=False))
+def import_products_command(formato, entrada):
+    """Reimporta un archivo generado por export-products (JSON Lines o columnar)."""
+    with open(entrada, 'rb') as f:
+        filas = leer_jsonl(f) if formato == 'jsonl' else leer_columnar(f)
+        count = importar_filas(filas)
+    click.echo(f"Se han cargado {count} productos correctamente.")
+
+#################################
+# Validación de filas e importación en lote
+#################################
+# Columnas de precio: un valor inválido se reemplaza por 0 (como en upload_products);
+# en el resto de las columnas validadas la fila se rechaza.
+IMPORT_COLUMNAS_PRECIO = ('precio_base', 'porcentaje_impuestos', 'porcentaje_ganancia')
+
+# Esquema por categoría: solo se validan las columnas que alimentan campos numéricos de Product
+# (precios y CSV_MAPEO_NUMERICO); las demás se guardan tal cual en 'detalles'.
+ESQUEMAS_NUMERICOS = {
+    categoria: [h for h in CSV_HEADERS[categoria]
+                if h in IMPORT_COLUMNAS_PRECIO or h in CSV_MAPEO_NUMERICO.get(categoria, {}).values()]
+    for categoria in CATEGORIAS
+}
+
+def coercionar_columna(valores):
+    """
+    Convierte una columna completa a float (vacíos y faltantes valen 0.0).
+    Los valores no numéricos o no finitos ('inf', 'nan') se marcan como inválidos.
+    Devuelve (numeros, posiciones_invalidas).
+    """
+    try:
+        numeros = [float(v) if v else 0.0 for v in valores]
+        if all(map(math.isfinite, numeros)):
+            return numeros, []
+    except (TypeError, ValueError):
+        pass
+    numeros = []
+    invalidas = []
+    for i, v in enumerate(valores):
+        if not v or not v.strip():
+            numeros.append(0.0)
+            continue
+        try:
+            numero = float(v)
+        except ValueError:
+            numero = None
+        if numero is None or not math.isfinite(numero):
+            numeros.append(0.0)
+            invalidas.append(i)
+        else:
+            numeros.append(numero)
+    return numeros, invalidas
+
+def producto_desde_fila(categoria, row, numeros):
+    """
+    Arma los datos de un Product a partir de una fila del CSV de la categoría.
+    'numeros' contiene los valores ya convertidos de las columnas numéricas del esquema.
+    Las columnas que no son propias de Product se guardan en 'detalles'.
+    """
+    numericas = CSV_NUMERICOS[categoria]
+    detalles = {}
+    for h in CSV_HEADERS[categoria]:
+        if h not in CSV_COLUMNAS_PRODUCTO:
+            detalles[h] = row.get(h, '0' if h in numericas else 'N/A')
+    datos = {
+        'nombre': row.get('modelo', 'N/A'),
+        'marca': row.get('marca', 'N/A'),
+        'codigo': detalles.get('tipo_inversor', '') if categoria == 'inversor' else '',
+        'precio_base': numeros.get('precio_base', 0.0),
+        'porcentaje_impuestos': numeros.get('porcentaje_impuestos', 0.0),
+        'porcentaje_ganancia': numeros.get('porcentaje_ganancia', 0.0),
+        'potencia': 0.0,
+        'voltaje_maximo': 0.0,
+        'string_count': 0,
+        'amperaje_maximo': 0.0,
+        'tipo': categoria,
+        'detalles': json.dumps(detalles),
+    }
+    for campo, h in CSV_MAPEO_NUMERICO.get(categoria, {}).items():
+        datos[campo] = int(numeros[h]) if campo == 'string_count' else numeros[h]
+    return datos
+
+def validar_filas(categoria, filas):
+    """
+    Etapa de validación: convierte en bloque (columna por columna) los valores numéricos
+    del esquema de la categoría y arma los datos de cada Product.
+    Devuelve (productos, errores).
+    """
+    numericas = ESQUEMAS_NUMERICOS[categoria]
+    columnas = {}
+    rechazadas = {}
+    for h in numericas:
+        numeros, invalidas = coercionar_columna([fila.get(h) for fila in filas])
+        columnas[h] = numeros
+        if h not in IMPORT_COLUMNAS_PRECIO:
+            for i in invalidas:
+                rechazadas.setdefault(i, h)
+    productos = []
+    errores = []
+    for i, fila in enumerate(filas):
+        if i in rechazadas:
+            h = rechazadas[i]
+            errores.append(f"fila {i + 2}: valor no numérico en '{h}' ({fila.get(h)})")
+            continue
+        productos.append(producto_desde_fila(categoria, fila, {h: columnas[h][i] for h in numericas}))
+    return productos, errores
+
+def categoria_desde_nombre(nombre):
+    """Deduce la categoría del nombre de archivo (p. ej. 'panel.csv' o 'proveedor_panel.csv')."""
+    base = os.path.splitext(os.path.basename(nombre))[0].lower()
+    for categoria in CATEGORIAS:
+        if base == categoria or base.endswith('_' + categoria):
+            return categoria
+    return None
+
+def procesar_archivo(nombre, categoria, contenido):
+    """
+    Parsea y valida un CSV dentro de un proceso del pool (no accede a la base de datos).
+    Devuelve (nombre, productos, errores); un archivo ilegible se informa en errores
+    sin interrumpir el resto del lote.
+    """
+    try:
+        reader = csv.DictReader(contenido.decode('utf-8-sig').splitlines())
+        filas = list(reader)
+    except UnicodeDecodeError:
+        return nombre, [], [f"{nombre}: el archivo no está en UTF-8, no se importó"]
+    except csv.Error as e:
+        return nombre, [], [f"{nombre}: CSV inválido ({e}), no se importó"]
+    errores = []
+    faltantes = [h for h in CSV_HEADERS[categoria] if h not in (reader.fieldnames or [])]
+    if faltantes:
+        errores.append(f"{nombre}: columnas faltantes ({', '.join(faltantes)}), se usan valores por defecto")
+    productos, errores_filas = validar_filas(categoria, filas)
+    errores.extend(f"{nombre}: {e}" for e in errores_filas)
+    return nombre, productos, errores
+
+def archivos_desde_zip(stream):
+    """
+    Devuelve [(nombre, categoria, contenido)] con los CSV de un ZIP.
+    Se ignoran los archivos ocultos y los metadatos que agrega macOS (__MACOSX/, ._archivo.csv).
+    """
+    archivos = []
+    with zipfile.ZipFile(stream) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or not info.filename.lower().endswith('.csv'):
+                continue
+            partes = info.filename.split('/')
+            if '__MACOSX' in partes or any(parte.startswith('.') for parte in partes):
+                continue
+            archivos.append((info.filename, categoria_desde_nombre(info.filename), zf.read(info)))
+    return archivos
+
+def importar_lote(archivos, max_workers=None):
+    """
+    Importa varios archivos [(nombre, categoria, contenido)] en paralelo.
+    Cada archivo se parsea y valida en un pool de procesos creado para esta importación
+    (a lo sumo un proceso por archivo) y cerrado al terminar; los resultados se escriben a
+    medida que llegan con un único escritor (importar_filas) en una sola transacción.
+    Devuelve (count, errores).
+    """
+    errores = []
+    validos = []
+    for nombre, categoria, contenido in archivos:
+        if categoria not in CATEGORIAS:
+            errores.append(f"{nombre}: no se pudo determinar la categoría")
+        else:
+            validos.append((nombre, categoria, contenido))
+    if not validos:
+        return 0, errores
+    max_workers = min(max_workers or app.config['IMPORT_WORKERS'] or os.cpu_count() or 1, len(validos))
+
+    def productos(resultados):
+        for _, datos, errores_archivo in resultados:
+            errores.extend(errores_archivo)
+            yield from datos
+
+    if max_workers == 1:
+        return importar_filas(productos(procesar_archivo(*a) for a in validos)), errores
+    # 'spawn': hacer fork de un worker con varios hilos (gunicorn gthread) no es seguro
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futuros = [pool.submit(procesar_archivo, *a) for a in validos]
+        count = importar_filas(productos(f.result() for f in as_completed(futuros)))
+    return count, errores
+
+@app.route('/upload_products/batch', methods=['GET', 'POST'])
+@login_required
+def upload_products_batch():
+    """
+    Carga en lote: acepta un ZIP y/o varios CSV (uno por categoría).
+    Cada campo 'files' tiene al lado un campo 'categorias'; si no se elige categoría
+    (o el archivo es un ZIP) se deduce del nombre del archivo.
+    Solo el usuario admin puede acceder a esta opción.
+    """
+    if current_user.role != 'admin':
+        flash("No tienes permiso para subir productos.", "danger")
+        return redirect(url_for('list_products'))
+    if request.method == 'POST':
+        # Los campos vacíos también se envían, así que archivos y categorías quedan alineados
+        seleccion = [(f, c) for f, c in zip_longest(request.files.getlist('files'), request.form.getlist('categorias'))
+                     if f is not None and f.filename]
+        if not seleccion:
+            flash("No se seleccionó ningún archivo.", "danger")
+            return redirect(request.url)
+        try:
+            archivos = []
+            for file, categoria in seleccion:
+                if file.filename.lower().endswith('.zip'):
+                    archivos.extend(archivos_desde_zip(BytesIO(file.stream.read())))
+                    continue
+                archivos.append((file.filename, categoria or categoria_desde_nombre(file.filename), file.stream.read()))
+            count, errores = importar_lote(archivos)
+            flash(f'Se han cargado {count} productos correctamente.', 'success')
+            if errores:
+                flash(f"Advertencias ({len(errores)}): {'; '.join(errores[:5])}", 'warning')
+            return redirect(url_for('list_products'))
+        except Exception as e:
+            flash(f'Error al procesar los archivos: {e}', 'danger')
+            return redirect(request.url)
+    else:
+        return render_template('upload_batch.html', categorias=CATEGORIAS)
+
+@app.cli.command('import-batch')
+@click.argument('rutas', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', type=int, default=None, help="Procesos a usar (por defecto, todos los núcleos).")
+def import_batch_command(rutas, workers):
+    """Importa un lote de proveedor: archivos ZIP o CSV con la categoría en el nombre."""
+    archivos = []
+    for ruta in rutas:
+        if ruta.lower().endswith('.zip'):
+            archivos.extend(archivos_desde_zip(ruta))
+        else:
+            with open(ruta, 'rb') as f:
+                archivos.append((ruta, categoria_desde_nombre(ruta), f.read()))
+    count, errores = importar_lote(archivos, max_workers=workers)
+    for error in errores:
+        click.echo(error, err=True)
+    click.echo(f"Se han cargado {count} productos correctamente.")
+
+#################################
+# Detección de productos duplicados
+#################################
+# Campos (columnas de Product o claves de 'detalles') que deben coincidir para
+# considerar dos productos de la misma categoría como posibles duplicados.
+DEDUP_CLAVES = {
+    'inversor': ['potencia'],
+    'panel': ['potencia'],
+    'protecciones_cc': ['tension_nominal_operacion'],
+    'protecciones_ca': ['tension_nominal_operacion'],
+    'estructura': ['cantidad_paneles'],
+    'cable': ['espesor'],
+    'fichas': ['tipo_ficha'],
+}
+DEDUP_NGRAMA = 3
+DEDUP_HASHES = 16          # funciones de hash de la firma MinHash
+DEDUP_FILAS_BANDA = 4      # valores de la firma por banda del LSH (4 bandas: umbral de Jaccard ~0.7)
+DEDUP_BANDA_MAX = 100      # cubetas con más productos se consideran demasiado comunes y no se comparan
+DEDUP_NGRAMA_COMUN = 0.01  # n-gramas presentes en más de esta fracción del bloque no entran en la firma
+DEDUP_UMBRAL = 0.8         # similitud mínima (por distancia de edición) entre cada palabra del modelo
+DEDUP_PALABRA_MIN = 6      # palabras más cortas deben coincidir exactamente ('ms' / 'mb', 'xyzwk' / 'xyzwq')
+DEDUP_UMBRAL_UNIDO = 0.95  # idem, cuando los modelos tienen distinta cantidad de palabras
+DEDUP_BLOQUE_DIRECTO = 16  # bloques de hasta este tamaño se comparan sin LSH
+DEDUP_VACIOS = VALORES_VACIOS + ('0',)  # valores que una fusión puede reemplazar
+
+# Cada n-grama da DEDUP_HASHES valores independientes de 32 bits (uno por función de hash)
+_MINHASH_VALORES = struct.Struct(f'<{DEDUP_HASHES}I')
+
+def normalizar_texto(texto):
+    """Minúsculas, sin acentos y solo letras/números separados por un espacio."""
+    texto = str(texto or '')
+    if not texto.isascii():
+        texto = unicodedata.normalize('NFKD', texto)
+        texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = texto.lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', texto))
+
+def _normalizar_valor(valor):
+    try:
+        return f"{float(valor):g}"
+    except (TypeError, ValueError):
+        return normalizar_texto(valor)
+
+def _ngramas(texto):
+    texto = texto.replace(' ', '')
+    if len(texto) <= DEDUP_NGRAMA:
+        return {texto} if texto else set()
+    return {texto[i:i + DEDUP_NGRAMA] for i in range(len(texto) - DEDUP_NGRAMA + 1)}
+
+def _firma_minhash(ngramas, memo):
+    """
+    Firma MinHash: para cada una de las DEDUP_HASHES funciones, el mínimo sobre los n-gramas.
+    'memo' guarda los hashes de cada n-grama, que se repiten mucho entre productos.
+    """
+    filas = []
+    for ngrama in ngramas:
+        hashes = memo.get(ngrama)
+        if hashes is None:
+            digest = hashlib.shake_128(ngrama.encode('utf-8')).digest(_MINHASH_VALORES.size)
+            hashes = memo[ngrama] = _MINHASH_VALORES.unpack(digest)
+        filas.append(hashes)
+    return tuple(map(min, zip(*filas)))
+
+def _parecidas(a, b, umbral):
+    """True si la distancia de edición entre a y b es a lo sumo (1 - umbral) * la longitud mayor."""
+    if a == b:
+        return True
+    if len(a) < len(b):
+        a, b = b, a
+    limite = int((1 - umbral) * len(a) + 1e-9)
+    if len(a) - len(b) > limite:
+        return False
+    # Solo se calcula la franja de la matriz a distancia <= limite de la diagonal
+    fuera = limite + 1
+    anterior = [j if j <= limite else fuera for j in range(len(b) + 1)]
+    for i, ca in enumerate(a, 1):
+        actual = [i if i <= limite else fuera] + [fuera] * len(b)
+        for j in range(max(1, i - limite), min(len(b), i + limite) + 1):
+            actual[j] = min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != b[j - 1]))
+        if min(actual) > limite:
+            return False
+        anterior = actual
+    return anterior[-1] <= limite
+
+_SUFIJO_VARIANTE = re.compile(r'\d([a-z]*)$')
+
+def _sufijo_variante(palabra):
+    """Letras después del último número ('550ms' -> 'ms'); None si la palabra no tiene números."""
+    coincidencia = _SUFIJO_VARIANTE.search(palabra)
+    return coincidencia.group(1) if coincidencia else None
+
+def _palabras_parecidas(a, b, umbral):
+    if a == b:
+        return True
+    if min(len(a), len(b)) < DEDUP_PALABRA_MIN:
+        return False
+    return _sufijo_variante(a) == _sufijo_variante(b) and _parecidas(a, b, umbral)
+
+def son_similares(a, b, umbral=DEDUP_UMBRAL):
+    """
+    Compara dos productos dados como (marca, palabras_del_modelo), ya normalizados.
+    Las marcas deben parecerse (o una contener a la otra) y cada palabra del modelo debe
+    parecerse a la palabra en la misma posición del otro: así un prefijo común largo no
+    oculta que la palabra que distingue al modelo es distinta. Las palabras de menos de
+    DEDUP_PALABRA_MIN caracteres y las letras que siguen al último número (la variante:
+    'CS6W-550MS' / 'CS6W-550MB') deben coincidir exactamente.
+    """
+    marca_a, palabras_a = a
+    marca_b, palabras_b = b
+    if (marca_a and marca_b and marca_a not in marca_b and marca_b not in marca_a
+            and not _parecidas(marca_a, marca_b, umbral)):
+        return False
+    if len(palabras_a) == len(palabras_b):
+        return all(_palabras_parecidas(x, y, umbral) for x, y in zip(palabras_a, palabras_b))
+    return _palabras_parecidas(''.join(palabras_a), ''.join(palabras_b), DEDUP_UMBRAL_UNIDO)
+
+def _admite_errores(palabras):
+    """False si el modelo solo puede parecerse a otro idéntico (palabras cortas y texto corto)."""
+    return (any(len(palabra) >= DEDUP_PALABRA_MIN for palabra in palabras)
+            or int((1 - DEDUP_UMBRAL_UNIDO) * sum(map(len, palabras)) + 1e-9) >= 1)
+
+def _claves_borrado(posicion, palabra):
+    """
+    La palabra y sus variantes sin un carácter, con su posición en el modelo:
+    dos palabras a distancia de edición 1 en la misma posición comparten una clave.
+    """
+    variantes = {palabra} | {palabra[:i] + palabra[i + 1:] for i in range(len(palabra))}
+    return [(posicion, variante) for variante in variantes]
+
+def _raiz(padres, x):
+    while padres[x] != x:
+        padres[x] = padres[padres[x]]
+        x = padres[x]
+    return x
+
+def _unir(padres, a, b):
+    ra, rb = _raiz(padres, a), _raiz(padres, b)
+    if ra != rb:
+        padres[max(ra, rb)] = min(ra, rb)
+
+def _unir_similares(miembros, entradas, padres, umbral):
+    """
+    Une los miembros de un bloque que son_similares.
+    Los bloques chicos se comparan directamente. En los grandes, cada producto se verifica contra
+    todos los candidatos que comparten alguna cubeta con él, salvo las cubetas que superan
+    DEDUP_BANDA_MAX. Las cubetas son:
+    - las bandas de un LSH sobre la firma MinHash de los n-gramas del modelo, sin los n-gramas
+      comunes a gran parte del bloque (prefijos de marca/serie);
+    - las _claves_borrado de las palabras poco comunes del modelo, que encuentran los errores de
+      tipeo de un carácter (en palabras cortas cambian demasiados n-gramas para que el LSH los
+      detecte); los errores en palabras comunes los encuentra el LSH, porque sus n-gramas no
+      entran en la firma.
+    Los modelos que no _admite_errores solo se agrupan por su texto exacto.
+    """
+    if len(miembros) <= DEDUP_BLOQUE_DIRECTO:
+        for i, a in enumerate(miembros):
+            for b in miembros[i + 1:]:
+                if son_similares(entradas[a], entradas[b], umbral):
+                    _unir(padres, a, b)
+        return
+    tipeables = {pid for pid in miembros if _admite_errores(entradas[pid][1])}
+    frecuencia_palabras = Counter(palabra for pid in tipeables for palabra in set(entradas[pid][1]))
+    limite = max(DEDUP_BLOQUE_DIRECTO, DEDUP_NGRAMA_COMUN * len(tipeables))
+    # Las palabras se repiten mucho entre productos: n-gramas, frecuencias y firmas se calculan por palabra
+    frecuencia = Counter()
+    for palabra, veces in frecuencia_palabras.items():
+        for ngrama in _ngramas(palabra):
+            frecuencia[ngrama] += veces
+    memo = {}
+    firmas = {}
+
+    def firma_palabra(palabra, completa=False):
+        """Firma de los n-gramas poco comunes de la palabra (o de todos); None si no queda ninguno."""
+        if (palabra, completa) not in firmas:
+            ngramas = _ngramas(palabra)
+            if not completa:
+                ngramas = {ngrama for ngrama in ngramas if frecuencia[ngrama] <= limite}
+            firmas[palabra, completa] = _firma_minhash(ngramas, memo) if ngramas else None
+        return firmas[palabra, completa]
+
+    cubetas = {}
+    for pid in miembros:
+        palabras = entradas[pid][1]
+        if pid in tipeables:
+            # La firma de la unión de los n-gramas es el mínimo, posición a posición, de las firmas de
+            # cada palabra; si todos los n-gramas son comunes se usan todos
+            partes = ([firma for firma in map(firma_palabra, palabras) if firma]
+                      or [firma for firma in (firma_palabra(p, True) for p in palabras) if firma])
+            firma = iter(partes[0] if len(partes) == 1 else map(min, *partes))
+            claves = chain(enumerate(zip(*[firma] * DEDUP_FILAS_BANDA)),
+                           *[_claves_borrado(i, palabra) for i, palabra in enumerate(palabras)
+                             if len(palabra) >= DEDUP_PALABRA_MIN and frecuencia_palabras[palabra] <= limite])
+        else:
+            claves = (''.join(palabras),)
+        candidatos = set()
+        for clave in claves:
+            cubeta = cubetas.get(clave)
+            # La mayoría de las cubetas tiene un solo producto: se guarda el id sin crear una lista
+            if cubeta is None:
+                cubetas[clave] = pid
+            elif type(cubeta) is int:
+                candidatos.add(cubeta)
+                cubetas[clave] = [cubeta, pid]
+            elif len(cubeta) < DEDUP_BANDA_MAX:
+                candidatos.update(cubeta)
+                cubeta.append(pid)
+        for otro in candidatos:
+            if _raiz(padres, otro) != _raiz(padres, pid) and son_similares(entradas[otro], entradas[pid], umbral):
+                _unir(padres, otro, pid)
+
+def buscar_duplicados(categoria=None, umbral=DEDUP_UMBRAL):
+    """
+    Agrupa productos probablemente duplicados sin comparar todos contra todos:
+    1. Los productos se separan en bloques por categoría, valores de DEDUP_CLAVES y
+       números presentes en marca/nombre/código.
+    2. Dentro de cada bloque, los que tienen la misma clave normalizada (marca, nombre, código)
+       se unen directamente.
+    3. El resto se compara con son_similares (con MinHash/LSH para elegir candidatos en los
+       bloques grandes).
+    Devuelve una lista de grupos {'tipo', 'productos', 'mas_barato'} ordenada por tamaño,
+    donde 'productos' está ordenado por precio final y cada producto indica con 'identico'
+    si su clave normalizada es la misma que la del más barato.
+    """
+    filas = {}
+    padres = {}
+    claves = {}
+    bloques = {}
+    entradas = {}
+    for fila in iterar_productos(categoria):
+        pid = fila['id']
+        detalles = _cargar_detalles(fila.pop('detalles'))
+        marca = normalizar_texto(fila['marca'])
+        modelo = normalizar_texto(f"{fila['nombre'] or ''} {fila['codigo'] or ''}")
+        # Los números del modelo (potencia, serie) deben coincidir: '450' y '455' son productos distintos
+        bloque = (fila['tipo'],) + tuple(
+            _normalizar_valor(fila[c] if c in fila else detalles.get(c))
+            for c in DEDUP_CLAVES.get(fila['tipo'], [])) + tuple(re.findall(r'\d+', f"{marca} {modelo}"))
+        fila['precio_final'] = calcular_precio_final(fila['precio_base'], fila['porcentaje_impuestos'],
+                                                     fila['porcentaje_ganancia'])
+        filas[pid] = fila
+        padres[pid] = pid
+        clave = fila['clave'] = (bloque, (marca + modelo).replace(' ', ''))
+        if clave in claves:
+            _unir(padres, claves[clave], pid)
+        else:
+            claves[clave] = pid
+            bloques.setdefault(bloque, []).append(pid)
+            palabras_marca = set(marca.split())
+            entradas[pid] = (marca.replace(' ', ''),
+                             [p for p in modelo.split() if p not in palabras_marca])
+    for miembros in bloques.values():
+        if len(miembros) > 1:
+            _unir_similares(miembros, entradas, padres, umbral)
+    grupos = {}
+    for pid in filas:
+        grupos.setdefault(_raiz(padres, pid), []).append(filas[pid])
+    resultado = []
+    for miembros in grupos.values():
+        if len(miembros) < 2:
+            continue
+        miembros.sort(key=lambda f: (f['precio_final'], f['id']))
+        referencia = miembros[0]['clave']
+        for fila in miembros:
+            fila['identico'] = fila.pop('clave') == referencia
+        resultado.append({'tipo': miembros[0]['tipo'], 'productos': miembros, 'mas_barato': miembros[0]})
+    resultado.sort(key=lambda g: (-len(g['productos']), g['tipo'], g['mas_barato']['id']))
+    return resultado
+
+def fusionar_productos(conservar_id, duplicados_ids):
+    """
+    Fusiona duplicados en el producto 'conservar_id': completa marca, código y las claves
+    de 'detalles' faltantes o con un valor de relleno (DEDUP_VACIOS: 'N/A', '' o '0', que las
+    cargas escriben cuando no hay dato) con los datos de los duplicados y luego los elimina.
+    Devuelve la cantidad de productos eliminados.
+    """
+    conservar = Product.query.get(conservar_id)
+    if conservar is None:
+        raise ValueError(f"No existe el producto {conservar_id}.")
+    detalles = _cargar_detalles(conservar.detalles)
+    eliminados = 0
+    for pid in duplicados_ids:
+        if pid == conservar_id:
+            continue
+        duplicado = Product.query.get(pid)
+        if duplicado is None:
+            continue
+        if duplicado.tipo != conservar.tipo:
+            raise ValueError("Solo se pueden fusionar productos de la misma categoría.")
+        if conservar.marca in DEDUP_VACIOS:
+            conservar.marca = duplicado.marca
+        if conservar.codigo in DEDUP_VACIOS:
+            conservar.codigo = duplicado.codigo
+        for clave, valor in _cargar_detalles(duplicado.detalles).items():
+            if detalles.get(clave) in DEDUP_VACIOS and valor not in DEDUP_VACIOS:
+                detalles[clave] = valor
+        db.session.delete(duplicado)
+        eliminados += 1
+    conservar.detalles = json.dumps(detalles)
+    db.session.commit()
+    return eliminados
+
+@app.route('/products/duplicates')
+@login_required
+def list_duplicates():
+    """
+    Muestra los grupos de productos probablemente duplicados con la oferta más barata de cada uno.
+    Solo el usuario admin puede acceder a esta opción.
+    """
+    if current_user.role != 'admin':
+        flash("No tienes permiso para ver duplicados.", "danger")
+        return redirect(url_for('list_products'))
+    categoria = request.args.get('categoria') or None
+    if categoria is not None and categoria not in CATEGORIAS:
+        flash("Categoría desconocida.", "danger")
+        return redirect(url_for('list_duplicates'))
+    grupos = buscar_duplicados(categoria)
+    return render_template('duplicates.html', grupos=grupos, categorias=CATEGORIAS, categoria=categoria)
+
+@app.route('/products/duplicates/merge', methods=['POST'])
+@login_required
+def merge_duplicates():
+    """
+    Fusiona los productos marcados de un grupo de duplicados en el producto elegido
+    (por defecto el más barato). Solo el usuario admin puede realizar esta acción.
+    """
+    if current_user.role != 'admin':
+        flash("No tienes permiso para fusionar productos.", "danger")
+        return redirect(url_for('list_products'))
+    try:
+        ids = [int(pid) for pid in request.form.getlist('ids')]
+        conservar_id = int(request.form.get('conservar'))
+        eliminados = fusionar_productos(conservar_id, ids)
+        flash(f"Se fusionaron {eliminados} productos duplicados.", "success")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"Error al fusionar los productos: {e}", "danger")
+    return redirect(url_for('list_duplicates'))
+
+@app.cli.command('find-duplicates')
+@click.option('--categoria', type=click.Choice(CATEGORIAS), default=None)
+@click.option('--umbral', type=float, default=DEDUP_UMBRAL, show_default=True)
+def find_duplicates_command(categoria, umbral):
+    """Lista los grupos de productos duplicados (para fusionarlos usar merge-products)."""
+    grupos = buscar_duplicados(categoria, umbral)
+    for grupo in grupos:
+        barato = grupo['mas_barato']
+        click.echo(f"[{grupo['tipo']}] {len(grupo['productos'])} productos, más barato: "
+                   f"#{barato['id']} {barato['marca']} {barato['nombre']} (${barato['precio_final']:.2f})")
+        for fila in grupo['productos']:
+            click.echo(f"    #{fila['id']} {fila['marca']} {fila['nombre']} {fila['codigo']} "
+                       f"${fila['precio_final']:.2f}")
+    click.echo(f"{len(grupos)} grupos de duplicados.")
+
+@app.cli.command('merge-products')
+@click.argument('conservar', type=int)
+@click.argument('duplicados', type=int, nargs=-1, required=True)
+def merge_products_command(conservar, duplicados):
+    """Fusiona los productos DUPLICADOS en CONSERVAR (flask merge-products 12 15 18)."""
+    eliminados = fusionar_productos(conservar, list(duplicados))
+    click.echo(f"Se fusionaron {eliminados} productos duplicados.")
+
+#################################
+# Historial de precios y consultas a una fecha
+#################################
+def parsear_fecha(valor):
+    """Convierte 'AAAA-MM-DD' o 'AAAA-MM-DDTHH:MM' en datetime; una fecha sola incluye todo el día."""
+    fecha = datetime.fromisoformat(valor)
+    if len(valor) == 10:
+        fecha = fecha.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return fecha
+
+def baja_a_fecha(product_id, fecha):
+    """True si a la fecha indicada el producto estaba eliminado (su última fila es una baja)."""
+    ultima = (db.session.query(PriceHistory.eliminado)
+              .filter(PriceHistory.product_id == product_id,
+                      PriceHistory.fecha <= fecha,
+                      db.or_(PriceHistory.eliminado, PriceHistory.precio_base.isnot(None)))
+              .order_by(PriceHistory.fecha.desc(), PriceHistory.id.desc())
+              .limit(1)
+              .scalar())
+    return bool(ultima)
+
+def precio_a_fecha(product_id, fecha):
+    """
+    Devuelve {precio_base, porcentaje_impuestos, porcentaje_ganancia, precio_final} vigentes
+    para el producto a la fecha indicada, o None si el producto todavía no existía o ya estaba eliminado.
+    """
+    if baja_a_fecha(product_id, fecha):
+        return None
+    valores = {}
+    for campo in PRECIO_CAMPOS:
+        columna = getattr(PriceHistory, campo)
+        valores[campo] = (db.session.query(columna)
+                          .filter(PriceHistory.product_id == product_id,
+                                  PriceHistory.fecha <= fecha,
+                                  columna.isnot(None))
+                          .order_by(PriceHistory.fecha.desc())
+                          .limit(1)
+                          .scalar())
+    if valores['precio_base'] is None:
+        return None
+    valores['precio_final'] = calcular_precio_final(valores['precio_base'], valores['porcentaje_impuestos'] or 0.0,
+                                                    valores['porcentaje_ganancia'] or 0.0)
+    return valores
+
+def _precios_a_fecha(campo, fecha):
+    """
+    Subconsulta (product_id, valor) con el último valor no nulo de 'campo' a la fecha indicada
+    (recorriendo su índice parcial). Si hay dos filas con la misma fecha se toma la mayor.
+    """
+    columna = getattr(PriceHistory, campo)
+    ultimo = (db.session.query(PriceHistory.product_id, db.func.max(PriceHistory.fecha).label('fecha'))
+              .filter(columna.isnot(None), PriceHistory.fecha <= fecha)
+              .group_by(PriceHistory.product_id)
+              .subquery())
+    return (db.session.query(PriceHistory.product_id.label('product_id'), ultimo.c.fecha,
+                             db.func.max(columna).label('valor'))
+            .join(ultimo, db.and_(PriceHistory.product_id == ultimo.c.product_id,
+                                  PriceHistory.fecha == ultimo.c.fecha))
+            .filter(columna.isnot(None))
+            .group_by(PriceHistory.product_id, ultimo.c.fecha)
+            .subquery())
+
+def catalogo_a_fecha(fecha, categoria=None):
+    """
+    Devuelve el catálogo con los precios vigentes a la fecha indicada. La consulta parte del
+    historial de precios con un LEFT JOIN a Product, así que los productos eliminados después
+    de la fecha (por ejemplo al fusionar duplicados) también aparecen, con 'eliminado'=True y el
+    tipo, nombre, marca y código guardados en su fila de baja (también al filtrar por categoría).
+    Los productos creados después de la fecha o eliminados antes no se incluyen.
+    """
+    base, impuestos, ganancia = (_precios_a_fecha(campo, fecha) for campo in PRECIO_CAMPOS)
+    bajas = (db.session.query(PriceHistory.product_id, db.func.max(PriceHistory.fecha).label('fecha'))
+             .filter(PriceHistory.eliminado, PriceHistory.fecha <= fecha)
+             .group_by(PriceHistory.product_id)
+             .subquery())
+    ultima_baja = (db.session.query(PriceHistory.product_id, db.func.max(PriceHistory.id).label('id'))
+                   .filter(PriceHistory.eliminado)
+                   .group_by(PriceHistory.product_id)
+                   .subquery())
+    registro_baja = db.aliased(PriceHistory)
+    nombres = [nombre for nombre, _ in columnas_producto()
+               if nombre not in PRECIO_CAMPOS and nombre not in ('id', 'detalles')]
+    # Para los productos eliminados, los datos guardados en su última fila de baja
+    columnas = {nombre: db.case((Product.id.is_(None), getattr(registro_baja, nombre)),
+                                else_=getattr(Product, nombre))
+                if nombre in BAJA_CAMPOS else getattr(Product, nombre)
+                for nombre in nombres}
+    query = (db.session.query(base.c.product_id, base.c.valor, impuestos.c.valor, ganancia.c.valor,
+                              Product.id, *columnas.values())
+             .select_from(base)
+             .outerjoin(impuestos, impuestos.c.product_id == base.c.product_id)
+             .outerjoin(ganancia, ganancia.c.product_id == base.c.product_id)
+             .outerjoin(Product, Product.id == base.c.product_id)
+             .outerjoin(bajas, bajas.c.product_id == base.c.product_id)
+             .outerjoin(ultima_baja, ultima_baja.c.product_id == base.c.product_id)
+             .outerjoin(registro_baja, registro_baja.id == ultima_baja.c.id)
+             # Sigue en el catálogo si no tuvo bajas o si se volvió a cargar después de la última
+             .filter(db.or_(bajas.c.fecha.is_(None), bajas.c.fecha < base.c.fecha)))
+    if categoria:
+        query = query.filter(columnas['tipo'] == categoria)
+    catalogo = []
+    for product_id, precio_base, porcentaje_impuestos, porcentaje_ganancia, existente, *datos in (
+            query.order_by(base.c.product_id).yield_per(EXPORT_LOTE)):
+        fila = dict(zip(nombres, datos))
+        fila.update({'id': product_id, 'eliminado': existente is None, 'precio_base': precio_base,
+                     'porcentaje_impuestos': porcentaje_impuestos or 0.0,
+                     'porcentaje_ganancia': porcentaje_ganancia or 0.0})
+        fila['precio_final'] = calcular_precio_final(fila['precio_base'], fila['porcentaje_impuestos'],
+                                                     fila['porcentaje_ganancia'])
+        catalogo.append(fila)
+    return catalogo
+
+@app.route('/products/<int:product_id>/history')
+@login_required
+def product_history(product_id):
+    """
+    Muestra el historial de precios de un producto y, si se indica ?fecha=, el precio vigente a esa fecha.
+    El historial se conserva al eliminar el producto, así que también funciona para productos eliminados
+    (sus datos se toman de la última fila de baja). Solo el usuario admin puede acceder a esta opción.
+    """
+    if current_user.role != 'admin':
+        flash("No tienes permiso para ver el historial de precios.", "danger")
+        return redirect(url_for('list_products'))
+    product = Product.query.get(product_id)
+    historial = (PriceHistory.query.filter_by(product_id=product_id)
+                 .order_by(PriceHistory.fecha.desc(), PriceHistory.id.desc()).all())
+    if product is None and not historial:
+        abort(404)
+    baja = next((h for h in historial if h.eliminado), None) if product is None else None
+    fecha = request.args.get('fecha')
+    precio = None
+    if fecha:
+        try:
+            precio = precio_a_fecha(product_id, parsear_fecha(fecha))
+        except ValueError:
+            flash("Fecha inválida.", "danger")
+            fecha = None
+    return render_template('price_history.html', product=product, baja=baja, product_id=product_id,
+                           historial=historial, fecha=fecha, precio=precio)
+
+@app.route('/products/as_of')
+@login_required
+def catalog_as_of():
+    """
+    Muestra el catálogo con los precios vigentes a la fecha indicada (?fecha=AAAA-MM-DD).
+    Solo el usuario admin puede acceder a esta opción.
+    """
+    if current_user.role != 'admin':
+        flash("No tienes permiso para ver el historial de precios.", "danger")
+        return redirect(url_for('list_products'))
+    fecha = request.args.get('fecha') or datetime.now().date().isoformat()
+    categoria = request.args.get('categoria') or None
+    if categoria is not None and categoria not in CATEGORIAS:
+        flash("Categoría desconocida.", "danger")
+        return redirect(url_for('catalog_as_of'))
+    try:
+        productos = catalogo_a_fecha(parsear_fecha(fecha), categoria)
+    except ValueError:
+        flash("Fecha inválida.", "danger")
+        return redirect(url_for('catalog_as_of'))
+    return render_template('catalog_as_of.html', productos=productos, fecha=fecha,
+                           categorias=CATEGORIAS, categoria=categoria)
+
 #################################
 # Rutas para ingreso de consumos
 #################################
@@ -635,13 +1789,14 @@ def armar_presupuesto():
     except:
         flash("No se encontraron datos de consumo. Ingresa nuevamente.", "warning")
         return redirect(url_for('consumo'))
-    inversores = Product.query.filter_by(tipo='inversor').all()
-    paneles = Product.query.filter_by(tipo='panel').all()
-    protecciones_cc = Product.query.filter_by(tipo='protecciones_cc').all()
-    protecciones_ca = Product.query.filter_by(tipo='protecciones_ca').all()
-    estructuras = Product.query.filter_by(tipo='estructura').all()
-    cables = Product.query.filter_by(tipo='cable').all()
-    fichas = Product.query.filter_by(tipo='fichas').all()
+    catalogo = catalogo_por_categoria()
+    inversores = catalogo['inversor']
+    paneles = catalogo['panel']
+    protecciones_cc = catalogo['protecciones_cc']
+    protecciones_ca = catalogo['protecciones_ca']
+    estructuras = catalogo['estructura']
+    cables = catalogo['cable']
+    fichas = catalogo['fichas']
     return render_template('armar_presupuesto.html',
                            consumo_anual=consumo_anual,
                            promedio_mensual=promedio_mensual,
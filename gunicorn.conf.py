@@ -0,0 +1,24 @@
+#########################
+# gunicorn.conf.py
+#########################
+# Uso: gunicorn -c gunicorn.conf.py wsgi:app
+# Variables de entorno: BIND, WEB_WORKERS, WEB_THREADS
+
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+
+# La app se carga una sola vez en el proceso principal (creación de tablas y del admin)
+# y luego se hace fork de los workers.
+preload_app = True
+
+def post_fork(server, worker):
+    """Cada worker abre sus propias conexiones: las heredadas del proceso principal no se comparten."""
+    from app import app, db, cache
+    with app.app_context():
+        db.engine.dispose(close=False)
+    cache.reiniciar()
@@ -0,0 +1,8 @@
+#########################
+# wsgi.py
+#########################
+# Punto de entrada para producción: gunicorn -c gunicorn.conf.py wsgi:app
+# La caché del catálogo por defecto es compartida (SQLite), así que todos los workers
+# y los comandos flask ven la misma versión del catálogo.
+
+from app import app  # noqa: F401